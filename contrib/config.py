@@ -22,6 +22,7 @@ class Config:
             raise RuntimeError(f"Failed to load labkit config: {e}")
 
         firstboot = config_data.data.get("firstboot", {})
+        ssh_dir = Path.home() / ".ssh"
 
         # 1. SSH User
         cls.SSH_USER = firstboot.get("ssh_user")
@@ -37,7 +38,6 @@ class Config:
             key_path_str = os.path.expanduser(key_path_str)
         else:
             # Auto-discover: id_ed25519 or id_rsa in ~/.ssh
-            ssh_dir = Path.home() / ".ssh"
             if (ssh_dir / "id_ed25519").exists():
                 key_path_str = str(ssh_dir / "id_ed25519")
             elif (ssh_dir / "id_rsa").exists():
@@ -53,7 +53,7 @@ class Config:
             scp = os.path.expandvars(os.path.expanduser(scp))
             cls.SSH_CONFIG_PATH = Path(scp)
         else:
-            cls.SSH_CONFIG_PATH = Path.home() / ".ssh" / "incus_config"
+            cls.SSH_CONFIG_PATH = ssh_dir / "incus_config"
 
         # 4. Logging
         log_level = firstboot.get("log_level")
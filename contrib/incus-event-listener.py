@@ -1,13 +1,17 @@
 """
 incus-event-listener: Event-Driven Automation for Incus
 """
+import os
 import sys
-import json
+import signal
 import subprocess
 import importlib
+import re
 from pathlib import Path
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from labkit.utils import json_loads
 
 logging.basicConfig(
     level=getattr(logging, Config.LOG_LEVEL, logging.INFO),
@@ -19,67 +23,129 @@ def load_plugins():
     plugins_dir = Path(__file__).parent / "plugins"
     sys.path.insert(0, str(plugins_dir))
     plugins = []
-    for pf in plugins_dir.glob("*.py"):
-        if pf.name.startswith("__") or pf.name == "example_template.py":
+    with os.scandir(plugins_dir) as it:
+        names = sorted(
+            e.name for e in it
+            if e.name.endswith(".py") and e.is_file()
+        )
+    for name in names:
+        if name.startswith("__") or name == "example_template.py":
             continue
-        modname = f"plugins.{pf.stem}"
+        stem = name[:-3]
+        modname = f"plugins.{stem}"
         try:
             module = importlib.import_module(modname)
             if hasattr(module, "handle_event"):
                 plugins.append(module)
-                logger.info(f"Loaded plugin: {pf.stem}")
+                logger.info("Loaded plugin: %s", stem)
             else:
-                logger.warning(f"Plugin '{modname}' missing 'handle_event(event)'")
+                logger.warning("Plugin '%s' missing 'handle_event(event)'", modname)
         except Exception as e:
-            logger.error(f"Failed to load plugin {modname}: {e}")
+            logger.error("Failed to load plugin %s: %s", modname, e)
     return plugins
 
+def index_plugins(plugins):
+    """
+    Map each action to the handle_event functions of the plugins that care
+    about it, as tuples. Plugins without INTERESTED_ACTIONS receive every
+    event; they alone handle actions no plugin declared.
+    """
+    catch_all = [p for p in plugins if getattr(p, "INTERESTED_ACTIONS", None) is None]
+    actions = {a for p in plugins for a in getattr(p, "INTERESTED_ACTIONS", None) or ()}
+    by_action = {
+        action: tuple(
+            p.handle_event for p in plugins
+            if p in catch_all or action in p.INTERESTED_ACTIONS
+        )
+        for action in actions
+    }
+    return by_action, tuple(p.handle_event for p in catch_all)
+
+def action_prefilter(actions):
+    """
+    Compile a byte pattern matching monitor lines for any of the given
+    actions, so other lines can be dropped without parsing them
+    """
+    alternatives = b"|".join(re.escape(a.encode()) for a in sorted(actions))
+    return re.compile(rb'"action":\s*"(?:' + alternatives + rb')"')
+
+def iter_lines(stream, size=65536):
+    """Yield the lines of a pipe, read in large chunks and split in bulk"""
+    fd = stream.fileno()
+    tail = b""
+    while chunk := os.read(fd, size):
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+def run_handler(handle_event, event):
+    """Call one plugin's handler, logging instead of raising"""
+    try:
+        handle_event(event)
+    except Exception as e:
+        logger.error("%s: %s", handle_event.__module__, e, exc_info=True)
+
 def main():
-    Config.load()  # ← One call, loads everything
-    logging.basicConfig(level=Config.LOG_LEVEL)
-    
-    logger.info("IncusLab started.")
     try:
-        Config.validate()
+        Config.load()  # ← One call, loads and validates everything
     except Exception as e:
-        logger.critical(f"Config error: {e}")
+        logger.critical("Config error: %s", e)
         return 1
+    logging.getLogger().setLevel(getattr(logging, Config.LOG_LEVEL, logging.INFO))
+
+    logger.info("IncusLab started.")
 
     cmd = ["incus", "monitor", "--format=json"]
     if Config.EVENT_TYPES:
         cmd += ["--type", ",".join(Config.EVENT_TYPES)]
 
     try:
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+        # Binary pipe read straight from its fd by iter_lines: both parsers
+        # take bytes directly, no per-line text decoding
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0) as proc:
+            # systemd stops us with SIGTERM: end the monitor so the read
+            # loop sees EOF right away and the workers drain cleanly
+            signal.signal(signal.SIGTERM, lambda signum, frame: proc.terminate())
             plugins = load_plugins()
             if not plugins:
                 logger.critical("No plugins loaded. Exiting.")
                 return 1
+            by_action, catch_all = index_plugins(plugins)
+            # Plugins without INTERESTED_ACTIONS need every line
+            prefilter = None if catch_all else action_prefilter(by_action)
+            debug = logger.isEnabledFor(logging.DEBUG)
+            # One worker per plugin: a slow handler no longer stalls the
+            # stream or the other plugins, and each plugin still sees its
+            # events in order
+            workers = {
+                p.handle_event: ThreadPoolExecutor(1, thread_name_prefix=p.__name__)
+                for p in plugins
+            }
 
-            for line in proc.stdout:
+            for line in iter_lines(proc.stdout):
                 line = line.strip()
-                if not line:
+                if not line or (prefilter and not prefilter.search(line)):
                     continue
                 try:
-                    event = json.loads(line)
-                    etype = event.get("type")
+                    event = json_loads(line)
                     action = event.get("metadata", {}).get("action")
-                    print(f"{etype} | {action}")
-                    logger.debug(f"{etype} | {action}")
-                    for plugin in plugins:
-                        try:
-                            plugin.handle_event(event)
-                        except Exception as e:
-                            logger.error(f"{plugin.__name__}: {e}", exc_info=True)
-                except json.JSONDecodeError:
-                    logger.warning(f"Bad JSON: {line[:60]}...")
+                    if debug:
+                        logger.debug("%s | %s", event.get("type"), action)
+                    for handle_event in by_action.get(action, catch_all):
+                        workers[handle_event].submit(run_handler, handle_event, event)
+                except ValueError:  # JSONDecodeError for both parsers
+                    logger.warning("Bad JSON: %.60s...", line.decode("utf-8", "replace"))
+            for worker in workers.values():
+                worker.shutdown()
     except KeyboardInterrupt:
         logger.info("Stopped by user.")
     except FileNotFoundError:
         logger.critical("'incus' command not found. Install Incus CLI.")
         return 1
     except Exception as e:
-        logger.critical(f"Unexpected: {e}", exc_info=True)
+        logger.critical("Unexpected: %s", e, exc_info=True)
         return 1
 
     return 0
@@ -7,38 +7,97 @@ Uses an Incus label to track completion: environment.firstboot.done
 import logging
 import subprocess
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Literal
 
 logger = logging.getLogger(__name__)
 
-INTERESTED_ACTIONS = {"instance-started"}
+INTERESTED_ACTIONS = frozenset({"instance-started"})
 LABEL_KEY = "environment.firstboot.done"
 
+# Containers set up concurrently, e.g. when a whole lab starts at once
+MAX_WORKERS = 8
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="firstboot")
+# Names queued or running, so a repeated start event does not set up twice
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+# One exec for everything the setup needs to read from the container:
+# os-release, then a marker line, then the ssh-keygen path (if any)
+PROBE_MARKER = "--- ssh-keygen"
+PROBE_SCRIPT = f"cat /etc/os-release; echo '{PROBE_MARKER}'; command -v ssh-keygen || true"
+
+# One exec for the hostname: $1 is the name, $2 the distro. Alpine gets
+# /etc/hostname directly, others use hostnamectl and fall back to the file.
+# Then map 127.0.1.1 to the name (Debian/Ubuntu/Alpine convention), once:
+# retries must not append duplicates. Incus names are [a-zA-Z0-9-], so $1
+# is safe inside the grep pattern.
+# Exit 1: hostname not set, exit 2: /etc/hosts not updated.
+HOSTNAME_SCRIPT = """
+if [ "$2" = alpine ] || ! hostnamectl set-hostname "$1"; then
+    printf '%s\\n' "$1" > /etc/hostname || exit 1
+fi
+grep -qE "^127\\.0\\.1\\.1[[:space:]]+$1([[:space:]]|\\$)" /etc/hosts 2>/dev/null ||
+    printf '127.0.1.1\\t%s\\n' "$1" >> /etc/hosts || exit 2
+"""
+
+# Distro families detect_distro() can report
+KNOWN_DISTROS = frozenset({
+    "alpine", "ubuntu", "debian", "centos", "rocky", "fedora", "cachyos", "arch", "void",
+})
+
+# The ID and ID_LIKE values of os-release, with optional quotes stripped
+OS_RELEASE_ID_RE = re.compile(r"""^(ID|ID_LIKE)=["']?([^"'\n]*)""", re.MULTILINE)
+
 # Supported distro families
 DistroType = Literal["alpine", "debian", "ubuntu", "centos", "rocky", "fedora", "unknown"]
 
 def handle_event(event) -> None:
+    if event.get("type") != "lifecycle":
+        return
     metadata = event.get("metadata", {})
     action = metadata.get("action")
-    etype = event.get("type")
     name = metadata.get("name", "unknown")
 
-    if etype != "lifecycle" or action not in INTERESTED_ACTIONS:
+    if action not in INTERESTED_ACTIONS:
         return
 
-    logger.info(f"Running first boot setup for {name}")
+    with _in_flight_lock:
+        if name in _in_flight:
+            logger.debug("First boot setup already in progress for %s", name)
+            return
+        _in_flight.add(name)
+    _executor.submit(run_firstboot, name)
+
+
+def run_firstboot(name: str) -> None:
+    """Run first boot setup for one container on a worker thread."""
+    try:
+        firstboot(name)
+    except Exception as e:
+        logger.error("First boot setup failed for %s: %s", name, e, exc_info=True)
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(name)
+
+
+def firstboot(name: str) -> None:
+    """Check, detect, regenerate keys, set hostname and mark the container done."""
+    logger.info("Running first boot setup for %s", name)
 
     # 1. Check if already completed
     if is_firstboot_done(name):
-        logger.debug(f"First boot already completed for {name}. Skipping.")
+        logger.debug("First boot already completed for %s. Skipping.", name)
         return
 
-    # 2. Detect distro
-    distro = detect_distro(name)
-    logger.info(f"Detected distro: {distro}")
+    # 2. Probe the container and detect distro
+    os_release, has_ssh_keygen = probe(name)
+    distro = detect_distro(name, os_release)
+    logger.info("Detected distro: %s", distro)
 
     # 3. Regenerate SSH host keys
-    if not regen_ssh_keys(name, distro):
+    if not regen_ssh_keys(name, distro, has_ssh_keygen):
         return  # retry on next start
 
     # 4. Set hostname
@@ -47,7 +106,7 @@ def handle_event(event) -> None:
 
     # 5. Mark as complete
     mark_firstboot_done(name)
-    logger.info(f"First boot setup completed for {name} ({distro})")
+    logger.info("First boot setup completed for %s (%s)", name, distro)
 
 
 def is_firstboot_done(name: str) -> bool:
@@ -55,146 +114,134 @@ def is_firstboot_done(name: str) -> bool:
     try:
         result = subprocess.run(
             ["incus", "config", "get", name, LABEL_KEY],
-            capture_output=True,
-            text=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
             timeout=5
         )
-        return result.returncode == 0 and result.stdout.strip() == "true"
+        return result.returncode == 0 and result.stdout.strip() == b"true"
     except Exception as e:
-        logger.warning(f"Failed to read firstboot label from {name}: {e}")
+        logger.warning("Failed to read firstboot label from %s: %s", name, e)
         return False
 
 
-def detect_distro(name: str) -> DistroType:
-    """Detect container OS family from /etc/os-release."""
+def probe(name: str) -> tuple[Optional[str], Optional[bool]]:
+    """Read /etc/os-release and look for ssh-keygen in a single exec.
+
+    Returns (None, None) when the container could not be probed.
+    """
     try:
-        # Read /etc/os-release
-        cmd = ["incus", "exec", name, "--", "cat", "/etc/os-release"]
+        cmd = ["incus", "exec", name, "--", "sh", "-c", PROBE_SCRIPT]
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+    except Exception as e:
+        logger.warning("Failed to probe %s: %s", name, e)
+        return None, None
 
-        if result.returncode != 0:
-            logger.warning(f"Failed to read /etc/os-release in {name}")
-            return "unknown"
+    if result.returncode != 0:
+        logger.warning("Failed to probe %s: %s", name, result.stderr.strip())
+        return None, None
 
-        content = result.stdout.lower()
-
-        if "alpine" in content:
-            return "alpine"
-        elif "ubuntu" in content:
-            return "ubuntu"
-        elif "debian" in content:
-            return "debian"
-        elif "centos" in content:
-            return "centos"
-        elif "rocky" in content:
-            return "rocky"
-        elif "fedora" in content:
-            return "fedora"
-        elif "cachyos" in content:
-            return "cachyos"
-        elif "arch" in content:
-            return "arch"
-        elif "void" in content:
-            return "void"
+    os_release, _, keygen = result.stdout.partition(PROBE_MARKER + "\n")
+    return os_release, bool(keygen.strip())
+
+
+def detect_distro(name: str, os_release: Optional[str] = None) -> DistroType:
+    """Detect container OS family from /etc/os-release.
+
+    Reads the file from the container unless its content is passed in.
+    """
+    try:
+        if os_release is None:
+            # Read /etc/os-release
+            cmd = ["incus", "exec", name, "--", "cat", "/etc/os-release"]
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+
+            if result.returncode != 0:
+                logger.warning("Failed to read /etc/os-release in %s", name)
+                return "unknown"
+            os_release = result.stdout
+
+        ids = dict(OS_RELEASE_ID_RE.findall(os_release))
+        # ID first, then the families it is like, in their listed order
+        tokens = f"{ids.get('ID', '')} {ids.get('ID_LIKE', '')}".lower().split()
+        distro = next((t for t in tokens if t in KNOWN_DISTROS), None)
+        if distro:
+            return distro
         else:
-            logger.info(f"Unknown distro for {name}: {result.stdout.splitlines()[0]}")
+            first_line = os_release.splitlines()[0] if os_release else ""
+            logger.info("Unknown distro for %s: %s", name, first_line)
             return "unknown"
 
     except Exception as e:
-        logger.error(f"Error detecting distro for {name}: {e}", exc_info=True)
+        logger.error("Error detecting distro for %s: %s", name, e, exc_info=True)
         return "unknown"
 
 
-def regen_ssh_keys(name: str, distro: DistroType) -> bool:
-    """Regenerate SSH host keys if ssh-keygen is available."""
+def regen_ssh_keys(name: str, distro: DistroType, has_ssh_keygen: Optional[bool] = None) -> bool:
+    """Regenerate SSH host keys if ssh-keygen is available.
+
+    Checks for ssh-keygen in the container unless the probe already did.
+    """
     try:
-        # Check if ssh-keygen exists
-        check_cmd = ["incus", "exec", name, "--", "which", "ssh-keygen"]
-        result = subprocess.run(check_cmd, capture_output=True, timeout=10)
-        if result.returncode != 0:
-            logger.info(f"ssh-keygen not found in {name}, skipping SSH key regeneration.")
+        if has_ssh_keygen is None:
+            # Check if ssh-keygen exists
+            check_cmd = ["incus", "exec", name, "--", "which", "ssh-keygen"]
+            result = subprocess.run(
+                check_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10
+            )
+            has_ssh_keygen = result.returncode == 0
+        if not has_ssh_keygen:
+            logger.info("ssh-keygen not found in %s, skipping SSH key regeneration.", name)
             return True  # Not an error — just skip
 
-        logger.info(f"Regenerating SSH host keys for {name}")
+        logger.info("Regenerating SSH host keys for %s", name)
         regen_cmd = [
             "incus", "exec", name, "--",
             "sh", "-c", "rm -f /etc/ssh/ssh_host_* && ssh-keygen -A -v"
         ]
-        result = subprocess.run(regen_cmd, capture_output=True, text=True, timeout=30)
+        # -v output is not used; only stderr is reported on failure
+        result = subprocess.run(
+            regen_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=30
+        )
 
         if result.returncode == 0:
-            logger.info(f"SSH host keys regenerated successfully for {name}")
+            logger.info("SSH host keys regenerated successfully for %s", name)
             return True
         else:
-            logger.error(f"Failed to regenerate SSH keys in {name}: {result.stderr.strip()}")
+            logger.error("Failed to regenerate SSH keys in %s: %s", name, result.stderr.strip())
             return False
 
     except Exception as e:
-        logger.error(f"Unexpected error during SSH key generation: {e}", exc_info=True)
+        logger.error("Unexpected error during SSH key generation: %s", e, exc_info=True)
         return False
 
 
 def set_hostname(name: str, distro: DistroType) -> bool:
     """Set the container's hostname based on distro."""
     try:
-        logger.info(f"Setting hostname to '{name}' ({distro})")
-
-        if distro == "alpine":
-            # Alpine: write /etc/hostname directly
-            push_cmd = [
-                "incus", "file", "push", "--", "/dev/stdin", f"{name}/etc/hostname"
-            ]
-            subprocess.run(
-                push_cmd,
-                input=name,
-                capture_output=True,
-                text=True,
-                timeout=10,
-                check=True
-            )
-            logger.debug(f"Wrote /etc/hostname: {name}")
+        logger.info("Setting hostname to '%s' (%s)", name, distro)
 
-        else:
-            # Systemd-based: use hostnamectl
-            cmd = ["incus", "exec", name, "--", "hostnamectl", "set-hostname", name]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-
-            if result.returncode != 0:
-                logger.warning(f"hostnamectl failed: {result.stderr.strip()}. Falling back to /etc/hostname.")
-
-                # Fallback: write /etc/hostname
-                push_cmd = [
-                    "incus", "file", "push", "--", "/dev/stdin", f"{name}/etc/hostname"
-                ]
-                subprocess.run(
-                    push_cmd,
-                    input=name,
-                    capture_output=True,
-                    text=True,
-                    timeout=10,
-                    check=True
-                )
-
-        # Ensure /etc/hosts maps 127.0.1.1 to hostname (Debian/Ubuntu/Alpine convention)
-        hosts_entry = f"127.0.1.1\t{name}"
-        cmd = [
-            "incus", "exec", name, "--",
-            "sh", "-c", f"echo '{hosts_entry}' >> /etc/hosts"
-        ]
+        # Name and distro are passed as positional args, never spliced into the script
+        cmd = ["incus", "exec", name, "--", "sh", "-c", HOSTNAME_SCRIPT, "sh", name, distro]
         result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=10
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=20
         )
-        if result.returncode != 0:
-            logger.warning(f"Failed to update /etc/hosts: {result.stderr.strip()}")
 
-        logger.info(f"Hostname set to '{name}'")
+        if result.returncode == 1:
+            logger.error("Failed to set hostname in %s: %s", name, result.stderr.strip())
+            return False
+        if result.returncode == 2:
+            logger.warning("Failed to update /etc/hosts: %s", result.stderr.strip())
+        elif result.returncode != 0:
+            logger.error("Failed to set hostname in %s: %s", name, result.stderr.strip())
+            return False
+        elif result.stderr.strip():
+            logger.warning("hostnamectl failed: %s. Fell back to /etc/hostname.", result.stderr.strip())
+
+        logger.info("Hostname set to '%s'", name)
         return True
 
     except Exception as e:
-        logger.error(f"Failed to set hostname in {name}: {e}", exc_info=True)
+        logger.error("Failed to set hostname in %s: %s", name, e, exc_info=True)
         return False
 
 
@@ -203,9 +250,10 @@ def mark_firstboot_done(name: str) -> None:
     try:
         subprocess.run(
             ["incus", "config", "set", name, f"{LABEL_KEY}=true"],
+            stdout=subprocess.DEVNULL,
             check=True,
             timeout=5
         )
-        logger.debug(f"Marked {name} as firstboot.done=true")
+        logger.debug("Marked %s as firstboot.done=true", name)
     except Exception as e:
-        logger.error(f"Failed to set firstboot label on {name}: {e}")
\ No newline at end of file
+        logger.error("Failed to set firstboot label on %s: %s", name, e)
\ No newline at end of file
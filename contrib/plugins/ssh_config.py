@@ -1,68 +1,210 @@
-import json
-import shutil
+import functools
+import os
 import subprocess
-import tempfile
+import threading
 from pathlib import Path
 import logging
 import time
 from config import Config
+from labkit.utils import fetch_instances
 
 logger = logging.getLogger(__name__)
 
-INTERESTED_ACTIONS = {
+INTERESTED_ACTIONS = frozenset({
     "instance-started",
     "instance-shutdown",
     "instance-stopped",
-}
+})
+
+# Actions after which the instance only has to leave the config
+STOP_ACTIONS = frozenset({"instance-shutdown", "instance-stopped"})
+
+# One Host block per running instance
+ENTRY_TEMPLATE = """Host {name}
+  HostName {address}
+  User {user}
+  PreferredAuthentications publickey
+  IdentityFile {key}
+  # StrictHostKeyChecking yes
+  # UserKnownHostsFile /dev/null
+"""
+
+@functools.cache
+def entry_template(user, key):
+    """ENTRY_TEMPLATE with the per-process user and key already filled in"""
+    def escape(value):
+        return str(value).replace("{", "{{").replace("}", "}}")
+    return ENTRY_TEMPLATE.format(
+        name="{name}", address="{address}", user=escape(user), key=escape(key),
+    )
+
+# Directories already created by this process
+_known_dirs = set()
+
+# (mtime_ns, size) and content of each config path when last seen
+_written = {}
+
+def holds_content(path, content):
+    """Whether path holds content now; the file is only re-read after it changed"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    key = (st.st_mtime_ns, st.st_size)
+    seen = _written.get(path)
+    if seen is None or seen[0] != key:
+        try:
+            seen = (key, path.read_text())
+        except OSError:
+            return False
+        _written[path] = seen
+    return seen[1] == content
+
+def write_atomic(path, content, mode=0o600):
+    """Write content next to path, then rename it over path in one step"""
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    try:
+        # write() on the file object retries short os.write() counts
+        with os.fdopen(fd, "wb") as f:
+            f.write(content.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+# A burst of events is refreshed at least once per this many settle delays
+MAX_COALESCE = 4
+
+# Pending refresh, shared by every event that arrives before it fires.
+# _refresh_due is when the newest pending event has had its full settle
+# delay; _refresh_since is when the oldest one arrived. _refresh_relist
+# is set when some pending event needs a new instance listing, rather
+# than only a write of entries already dropped
+_refresh_timer = None
+_refresh_due = 0.0
+_refresh_since = 0.0
+_refresh_relist = False
+_refresh_lock = threading.Lock()
+# Guards _entries and keeps a refresh that fires mid-write from racing
+# the one writing
+_write_lock = threading.Lock()
+# Rendered Host block per instance, as last written; None until the
+# first refresh has listed the instances
+_entries = None
 
 def handle_event(event):
+    if event.get("type") != "lifecycle":
+        return
     metadata = event.get("metadata", {})
     action = metadata.get("action")
-    etype = event.get("type")
 
-    if etype != "lifecycle" or action not in INTERESTED_ACTIONS:
+    if action not in INTERESTED_ACTIONS:
         return
 
-    time.sleep(Config.WAIT_FOR_INSTANCE_SEC)
-    logger.info(f"Updating SSH config due to: {action}")
+    name = metadata.get("name")
+    if action in STOP_ACTIONS and name and _entries is not None:
+        # Stopped instances only leave the config: no listing needed
+        with _write_lock:
+            dropped = _entries.pop(name, None) is not None
+        if dropped:
+            logger.info("Removing SSH config entry for %s", name)
+            schedule_refresh(action, relist=False)
+        return
+
+    schedule_refresh(action, relist=True)
+
+def schedule_refresh(action, relist):
+    """
+    Trailing debounce: every event gets its full settle delay, and a burst
+    of starts or stops is folded into one listing and one write
+    """
+    global _refresh_due, _refresh_since, _refresh_relist
+    now = time.monotonic()
+    with _refresh_lock:
+        _refresh_due = now + Config.WAIT_FOR_INSTANCE_SEC
+        _refresh_relist = _refresh_relist or relist
+        if _refresh_timer is not None:
+            logger.debug("SSH config refresh already pending: %s", action)
+            return
+        _refresh_since = now
+        arm_refresh(Config.WAIT_FOR_INSTANCE_SEC, action)
+
+def arm_refresh(delay, action):
+    """Start the refresh timer; called with _refresh_lock held"""
+    global _refresh_timer
+    _refresh_timer = threading.Timer(delay, refresh_config, (action,))
+    _refresh_timer.start()
+
+def refresh_config(action):
+    global _refresh_timer, _refresh_since, _refresh_relist
+    with _refresh_lock:
+        now = time.monotonic()
+        remaining = _refresh_due - now
+        relist = _refresh_relist
+        if remaining > 0:
+            if now - _refresh_since < MAX_COALESCE * Config.WAIT_FOR_INSTANCE_SEC:
+                # A newer event is still settling: wait for it instead
+                arm_refresh(remaining, action)
+                return
+            # Burst ran past the cap: refresh now, and once more after the
+            # newest event has settled
+            _refresh_since = now
+            arm_refresh(remaining, action)
+        else:
+            _refresh_timer = None
+            _refresh_relist = False
+    with _write_lock:
+        if relist:
+            update_config(action)
+            return
+        try:
+            write_config()
+        except Exception as e:
+            logger.error("SSH plugin error: %s", e, exc_info=True)
+
+def update_config(action):
+    global _entries
+    logger.info("Updating SSH config due to: %s", action)
     try:
-        result = subprocess.run(["incus", "list", "--format=json"], check=True, capture_output=True, text=True)
-        containers = json.loads(result.stdout)
-        entries = []
+        containers = fetch_instances()
+        entries = {}
 
-        print(f"container count: {len(containers)}")
+        logger.debug("container count: %d", len(containers))
+        template = entry_template(Config.SSH_USER, Config.SSH_KEY_PATH)
         for c in containers:
             if c["status"] != "Running":
                 continue
-            net = c.get("state", {}).get("network", {})
-            for iface_name in ["eth0", "net0"]:
-                iface = net.get(iface_name)
-                if not iface:
-                    continue
-                for addr in iface.get("addresses", []):
-                    if addr["family"] == "inet" and addr["scope"] != "link":
-                        entry = f"""Host {c["name"]}
-  HostName {addr["address"]}
-  User {Config.SSH_USER}
-  PreferredAuthentications publickey
-  IdentityFile {Config.SSH_KEY_PATH}
-  # StrictHostKeyChecking yes
-  # UserKnownHostsFile /dev/null
-"""
-                        entries.append(entry)
-                        break
-                break
-
-        temp_fd = tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".tmp")
-        temp_fd.write("\n".join(entries) + "\n")
-        temp_fd.close()
-
-        config_path = Path(Config.SSH_CONFIG_PATH)
-        config_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.move(temp_fd.name, config_path)
-        logger.info(f"Updated SSH config for {len(entries)} containers")
+            net = c.get("state", {}).get("network") or {}
+            # First global IPv4 address on eth0, else on net0
+            addr = next((
+                a for iface in (net.get("eth0"), net.get("net0")) if iface
+                for a in iface.get("addresses", ())
+                if a["family"] == "inet" and a["scope"] != "link"
+            ), None)
+            if addr is not None:
+                entries[c["name"]] = template.format(name=c["name"], address=addr["address"])
+        _entries = entries
+        write_config()
 
     except subprocess.CalledProcessError as e:
-        logger.error(f"'incus list' failed: {e}")
+        logger.error("'incus list' failed: %s", e)
     except Exception as e:
-        logger.error(f"SSH plugin error: {e}", exc_info=True)
\ No newline at end of file
+        logger.error("SSH plugin error: %s", e, exc_info=True)
+
+def write_config():
+    """Write the current entries, unless the file already holds them"""
+    config_path = Path(Config.SSH_CONFIG_PATH)
+    if config_path.parent not in _known_dirs:
+        config_path.parent.mkdir(parents=True, exist_ok=True)
+        _known_dirs.add(config_path.parent)
+    content = "\n".join(_entries.values()) + "\n"
+    if holds_content(config_path, content):
+        logger.info("SSH config unchanged (%d containers)", len(_entries))
+        return
+    write_atomic(config_path, content)
+    st = os.stat(config_path)
+    _written[config_path] = ((st.st_mtime_ns, st.st_size), content)
+    logger.info("Updated SSH config for %d containers", len(_entries))
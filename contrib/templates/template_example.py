@@ -8,22 +8,23 @@ import logging
 logger = logging.getLogger(__name__)
 
 # List of actions this plugin cares about
-INTERESTED_ACTIONS = {
+INTERESTED_ACTIONS = frozenset({
     "container-started",
     "container-stopped",
-}
+})
 
 def handle_event(event):
+    # Filter by type first, then by action
+    if event.get("type") != "lifecycle":
+        return
     metadata = event.get("metadata", {})
     action = metadata.get("action")
-    etype = event.get("type")
 
-    # Filter by type and action
-    if etype != "lifecycle" or action not in INTERESTED_ACTIONS:
+    if action not in INTERESTED_ACTIONS:
         return
 
     name = metadata.get("name", "unknown")
-    logger.info(f"Example plugin triggered by {action} on {name}")
+    logger.info("Example plugin triggered by %s on %s", action, name)
 
     # Your custom logic here
     # - exec shell commands
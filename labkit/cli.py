@@ -10,68 +10,38 @@ from pathlib import Path
 import sys
 import glob
 import shutil
-import yaml
-from labkit.global_config import LabkitConfig
 from .global_config import LabkitConfig
+from .config import LabYamlCache
 
-from .utils import container_exists, run, info, success, error, warning, fatal, \
-    BOLD, RESET
-from .lab import Lab, list_templates
+from .utils import container_exists, list_containers, list_subdirs, run, info, success, error, \
+    warning, fatal, confirm, BOLD, RESET
+
+# Alternative spellings accepted for the `rm` actions
+RM_ALIASES = ["del", "remove", "delete"]
 
 def main():
     """
     main: main loop for the program
     """
-    parser = argparse.ArgumentParser(description="labkit - Incus lab manager")
-    subparsers = parser.add_subparsers(dest="command", required=True)
-
-    # labkit new <name>
-    prepare_cmd_new(subparsers)
-
-    # labkit init
-    prepare_cmd_init(subparsers)
-
-    # labkit list
-    prepare_cmd_list(subparsers)
-
-    # labkit template
-    prepare_cmd_template(subparsers)
-
-    # labkit node add
-    prepare_cmd_node(subparsers)
+    parser = build_parser(sys.argv[1] if len(sys.argv) > 1 else None)
 
-    # labkit requires
-    prepare_cmd_requires(subparsers)
-
-    # labkit up
-    prepare_cmd_up(subparsers)
+    args = parser.parse_args()
+    _COMMANDS[args.command](args)
 
-    # labkit down
-    prepare_cmd_down(subparsers)
+def build_parser(command=None):
+    """
+    build_parser: builds the argument parser, registering only the subparser for
+    `command` when it is known. Top-level help and unknown commands get every
+    subparser so usage and error output stay complete.
+    """
+    parser = argparse.ArgumentParser(description="labkit - Incus lab manager")
+    subparsers = parser.add_subparsers(dest="command", required=True)
 
-    # labkit migrate
-    prepare_cmd_migrate(subparsers)
+    builder = _PARSER_BUILDERS.get(command)
+    for prepare in ([builder] if builder else _PARSER_BUILDERS.values()):
+        prepare(subparsers)
 
-    args = parser.parse_args()
-    if args.command == "new":
-        cmd_new(args)
-    elif args.command == "init":
-        cmd_init(args)
-    elif args.command == "list":
-        cmd_list(args)
-    elif args.command == "node":
-        cmd_node(args)
-    elif args.command == "requires":
-        cmd_requires(args)
-    elif args.command == "up":
-        cmd_up(args)
-    elif args.command == "down":
-        cmd_down(args)
-    elif args.command == "migrate":
-        cmd_migrate(args)
-    elif args.command == "template":
-        if args.action == "list":
-            list_templates()
+    return parser
 
 def prepare_cmd_new(subparsers):
     """
@@ -92,7 +62,7 @@ def cmd_new(args):
     config = LabkitConfig().load()  # Load global config
     current_dir = Path.cwd()
 
-    if str(current_dir) != str(config.data["default_root"]):
+    if os.path.realpath(current_dir) != config.default_root:
         # If --allow-scattered, add parent dir to search_paths
         if getattr(args, "allow_scattered", False):
             if config.add_search_path(current_dir):
@@ -139,6 +109,8 @@ def cmd_init(args, check_passed=False):
     """
     cmd_init: handles 'init' command
     """
+    from .lab import Lab
+
     current_dir = Path.cwd()
     config = LabkitConfig().load()
 
@@ -147,7 +119,7 @@ def cmd_init(args, check_passed=False):
         return
 
     if not check_passed:
-        if str(current_dir.parent) != str(config.data["default_root"]):
+        if os.path.realpath(current_dir.parent) != config.default_root:
             if getattr(args, "allow_scattered", False):
                 parent_dir = current_dir.parent
                 if config.add_search_path(parent_dir):
@@ -189,8 +161,8 @@ def prepare_cmd_node(subparsers):
     add_node_p.add_argument("name", help="Node/container name")
     add_node_p.add_argument("--template", help="Use specific template (overrides lab.yaml)")
 
-    rm_node_p = node_sub.add_parser("rm", aliases=['del', 'remove', 'delete'],
-                                    help="Remove a node")
+    rm_node_p = node_sub.add_parser("rm", aliases=RM_ALIASES, help="Remove a node")
+    rm_node_p.set_defaults(action="rm")  # report aliases as "rm"
     rm_node_p.add_argument("name", help="Node/container name")
     rm_node_p.add_argument("--force", action="store_true", help="Stop and delete if running")
 
@@ -206,6 +178,8 @@ def cmd_node(args):
     """
     cmd_node: handles 'node' command
     """
+    from .lab import Lab
+
     current_dir = Path.cwd()
     if not (current_dir / "lab.yaml").exists():
         error("This is not a lab directory. Run 'labkit init' first.")
@@ -222,7 +196,7 @@ def cmd_node(args):
             lab.add_node(args.name, template=args.template, dry_run=args.dry_run)
         except RuntimeError as e:
             error(f"Failed to add node: {e}")
-    elif args.action in ["rm", "remove", "del", "delete"]:
+    elif args.action == "rm":
         try:
             lab.remove_node(args.name, force=args.force, dry_run=args.dry_run)
         except RuntimeError as e:
@@ -239,32 +213,35 @@ def prepare_cmd_list(subparsers):
     list_p.add_argument("--running", action="store_true",
                         help="Only show labs with at least one local node running")
 
-def _process_root(root, labs, container_map, seen_paths):
-    parent_dir = [entry.path for entry in os.scandir(root) if entry.is_dir()]
-    for p in parent_dir:
-        p = Path(p)
-        if not p.is_dir() or p in seen_paths:
+def _expand_search_path(base_path):
+    if "*" not in str(base_path):
+        return [base_path]
+    return glob.glob(str(base_path))
+
+def _process_root(root, labs, container_map, seen_paths, yaml_cache):
+    for name in list_subdirs(root):
+        p = Path(root) / name
+        if p in seen_paths:
             continue
 
         seen_paths.add(p)
         lab_yaml = p / "lab.yaml"
 
-        if not lab_yaml.exists():
-            continue
+        try:
+            st = lab_yaml.stat()
+        except OSError:
+            continue  # missing or unreadable, as exists() treated it
 
         try:
-            data = yaml.safe_load(lab_yaml.read_text()) or {}
+            data = yaml_cache.read(lab_yaml, st)
             lab_name = data.get("name") or p.name
             template = data.get("template", "unknown")
-            mtime = lab_yaml.stat().st_mtime
+            mtime = st.st_mtime
 
             # Get local node names (from nodes/ subdirs)
-            nodes_dir = p / "nodes"
-            local_node_names = []
-            if nodes_dir.exists():
-                local_node_names = [
-                    f"{lab_name}-{d.name}" for d in nodes_dir.iterdir() if d.is_dir()
-                ]
+            local_node_names = [
+                f"{lab_name}-{n}" for n in list_subdirs(p / "nodes")
+            ]
 
             # Count how many are running
             running_count = sum(
@@ -285,6 +262,14 @@ def _process_root(root, labs, container_map, seen_paths):
         except Exception as e:
             warning(f"Failed to read {p}: {e}")
 
+def cmd_template(args):
+    """
+    cmd_template: template subcommand handler
+    """
+    if args.action == "list":
+        from .lab import list_templates
+        list_templates()
+
 def cmd_list(args):
     """
     cmd_list: handles 'list' command
@@ -293,22 +278,21 @@ def cmd_list(args):
 
     # Fetch all containers once
     try:
-        result = run(["incus", "list", "--format=json"], check=True, silent=True)
-        all_containers = json.loads(result.stdout)
-        container_map = {c["name"]: c["status"] for c in all_containers}
+        container_map = {c["name"]: c["status"] for c in list_containers()}
     except Exception as e:
         error(f"Failed to query Incus: {e}")
         return
 
     labs = []
     seen_paths = set()
+    yaml_cache = LabYamlCache()
 
-    for base_path in config.data["search_paths"]:
+    for base_path in config.search_paths:
         if not base_path.exists():
             continue
-        candidates = ([base_path] if "*" not in str(base_path) else glob.glob(str(base_path)))
-        for candidate in candidates:
-            _process_root(candidate, labs, container_map, seen_paths)
+        for candidate in _expand_search_path(base_path):
+            _process_root(candidate, labs, container_map, seen_paths, yaml_cache)
+    yaml_cache.save()
 
     # Sort by mtime
     labs.sort(key=lambda x: x["mtime"], reverse=True)
@@ -326,6 +310,7 @@ def _print_table(labs):
     headers = ["NAME", "NODES", "LOCAL UP", "RUNNING", "TEMPLATE", "LAST MODIFIED", "PATH"]
     rows = []
     now = datetime.now()
+    home = Path.home()
 
     def _ago(dt):
         diff = now - datetime.fromtimestamp(dt)
@@ -348,7 +333,7 @@ def _print_table(labs):
             "yes" if lab["has_running"] else "no",
             lab["template"],
             _ago(lab["mtime"]),
-            f"~/{lab['path'].relative_to(Path.home())}" if lab['path'].is_relative_to(Path.home())
+            f"~/{lab['path'].relative_to(home)}" if lab['path'].is_relative_to(home)
                 else str(lab['path'])
         ])
 
@@ -381,8 +366,9 @@ def prepare_cmd_requires(subparsers):
     req_add_p = req_sub.add_parser("add", help="Declare that this lab requires a shared node")
     req_add_p.add_argument("names", nargs="+", help="Node names to require")
 
-    req_rm_p = req_sub.add_parser("rm", aliases=['del', 'remove', 'delete'],
+    req_rm_p = req_sub.add_parser("rm", aliases=RM_ALIASES,
                                   help="Remove requirement for a shared node")
+    req_rm_p.set_defaults(req_action="rm")  # report aliases as "rm"
     req_rm_p.add_argument("names", nargs="+", help="Node names to unrequire")
 
     for subparser in [req_add_p, req_rm_p]:
@@ -396,6 +382,8 @@ def cmd_requires(args):
     """
     cmd_requires: handles 'requires' command
     """
+    from .lab import Lab
+
     current_dir = Path.cwd()
     lab_yaml = current_dir / "lab.yaml"
     if not lab_yaml.exists():
@@ -416,7 +404,7 @@ def cmd_requires(args):
                 error(f"Failed to add required node: {e}")
                 return
 
-        case "rm" | "remove" | "del" | "delete":
+        case "rm":
             try:
                 lab.remove_requirement(args.names, args.dry_run)
             except RuntimeError as e:
@@ -432,9 +420,7 @@ def cmd_requires(args):
             else:
                 info("No external node requirements declared")
         case "check":
-            result = run(["incus", "list", "--format=json"], silent=True)
-            containers = json.loads(result.stdout)
-            running = {c["name"] for c in containers if c["status"] == "Running"}
+            running = {c["name"] for c in list_containers() if c["status"] == "Running"}
             missing = [n for n in lab.config.get("requires_nodes", []) if n not in running]
             if missing:
                 error(f"Required nodes not running: {', '.join(missing)}")
@@ -463,6 +449,8 @@ def cmd_up(args):
     """
     cmd_up: handles 'up' command
     """
+    from .lab import Lab
+
     current_dir = Path.cwd()
     if not (current_dir / "lab.yaml").exists():
         fatal("This is not a lab directory. Run 'labkit init' first.")
@@ -508,6 +496,8 @@ def cmd_down(args):
     """
     cmd_down: handles 'down' command
     """
+    from .lab import Lab
+
     current_dir = Path.cwd()
     if not (current_dir / "lab.yaml").exists():
         fatal("This is not a lab directory. Run 'labkit init' first.")
@@ -551,34 +541,26 @@ def cmd_migrate(args):
     cmd_migrate: handles 'migrate' command
     """
     config = LabkitConfig().load()
-    all_containers_result = run(
-        ["incus", "list", "--format=json"],
-        silent=True, check=True,
-    )
-    all_container_names = {c["name"] for c in json.loads(all_containers_result.stdout)}
+    all_container_names = {c["name"] for c in list_containers()}
 
     migrated_count = 0
     actions = []
+    yaml_cache = LabYamlCache()
 
-    for base_path in config.data["search_paths"]:
-        candidates = [base_path] if "*" not in str(base_path) else glob.glob(str(base_path))
-        for p in candidates:
+    for base_path in config.search_paths:
+        for p in _expand_search_path(base_path):
             p = Path(p)
-            lab_dirs = [child for child in p.iterdir() if child.is_dir()]
+            lab_dirs = [p / name for name in list_subdirs(p)]
             for lab_dir in lab_dirs:
                 lab_yaml = lab_dir / "lab.yaml"
                 if not lab_yaml.exists():
                     continue
 
                 try:
-                    data = yaml.safe_load(lab_yaml.read_text()) or {}
+                    data = yaml_cache.read(lab_yaml)
                     lab_name = data.get("name") or lab_dir.name
-                    nodes_dir = lab_dir / "nodes"
-                    if not nodes_dir.exists():
-                        continue
-
                     # Get expected node names
-                    node_basenames = [d.name for d in nodes_dir.iterdir() if d.is_dir()]
+                    node_basenames = list_subdirs(lab_dir / "nodes")
 
                     for basename in node_basenames:
                         unscoped_name = basename
@@ -610,6 +592,8 @@ def cmd_migrate(args):
                 except Exception as e:
                     warning(f"Failed to process {p}: {e}")
 
+    yaml_cache.save()
+
     # Show plan
     if not actions:
         success("All labs are already using scoped container names")
@@ -646,11 +630,6 @@ def _rename_container(old: str, new: str):
     run(["incus", "move", old, new], check=True)
 
 
-def confirm(prompt: str) -> bool:
-    """Simple yes/no prompt"""
-    reply = input(f"{prompt} (y/N): ").strip().lower()
-    return reply in ("y", "yes")
-
 def prepare_cmd_template(subparsers):
     """
     prepare_cmd_node: prepares parser for subcommand and args for `template`
@@ -659,3 +638,29 @@ def prepare_cmd_template(subparsers):
                                        help="Initialize current directory as a lab")
     template_sub = template_p.add_subparsers(dest="action", required=True)
     template_sub.add_parser("list", help="List node templates")
+
+# Subcommand → parser builder, in help listing order
+_PARSER_BUILDERS = {
+    "new": prepare_cmd_new,
+    "init": prepare_cmd_init,
+    "list": prepare_cmd_list,
+    "template": prepare_cmd_template,
+    "node": prepare_cmd_node,
+    "requires": prepare_cmd_requires,
+    "up": prepare_cmd_up,
+    "down": prepare_cmd_down,
+    "migrate": prepare_cmd_migrate,
+}
+
+# Subcommand → handler
+_COMMANDS = {
+    "new": cmd_new,
+    "init": cmd_init,
+    "list": cmd_list,
+    "template": cmd_template,
+    "node": cmd_node,
+    "requires": cmd_requires,
+    "up": cmd_up,
+    "down": cmd_down,
+    "migrate": cmd_migrate,
+}
@@ -1,28 +1,74 @@
 """
 config.py: module for handling homelab configuration 
 """
+from collections.abc import Mapping
+import functools
+import json
 import os
 from pathlib import Path
+from types import MappingProxyType
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader, SafeDumper
+
+CACHE_FILE = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "labkit" / "labs.json"
 
 # Define non-direct user-needs here, override will come from cmd args
 DEFAULT_LAB_CONFIG = {
     "name": "unnamed-lab",
     "template": "golden-image",
     "network_mode": "shared",  # 'shared' or later 'isolated'
-    "shared_storage": {
+    "shared_storage": MappingProxyType({
         "enabled": True,
         "mount_point": "/lab/shared"
-    },
-    "node_mount": {
+    }),
+    "node_mount": MappingProxyType({
         "source_dir": "nodes",
         "mount_point": "/lab/node",
         "readonly": False
-    },
+    }),
     "user": os.getenv("SUDO_USER") or os.getenv("USER", "unknown"),
     "managed_by": "labkit"
 }
 
+def validate_config(data, defaults):
+    """
+    validate_config: checks a loaded YAML document against the shape of its
+    defaults (top-level mapping, nested sections stay mappings) and returns it
+    """
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a mapping, got {type(data).__name__}")
+    for key, value in data.items():
+        if isinstance(defaults.get(key), Mapping) and not isinstance(value, dict):
+            raise ValueError(f"'{key}' must be a mapping, got {type(value).__name__}")
+    return data
+
+def fill_defaults(data, defaults):
+    """
+    fill_defaults: fills keys missing from data in place, section by section,
+    copying only the default sections data does not already provide
+    """
+    for key, default in defaults.items():
+        value = data.get(key)
+        if key not in data:
+            data[key] = dict(default) if isinstance(default, Mapping) else default
+        elif isinstance(default, Mapping) and isinstance(value, dict):
+            for sub_key, sub_default in default.items():
+                value.setdefault(sub_key, sub_default)
+    return data
+
+@functools.cache
+def default_lab_yaml():
+    """
+    default_lab_yaml: the default lab.yaml document, rendered once per process
+    """
+    return yaml.dump(fill_defaults({}, DEFAULT_LAB_CONFIG), Dumper=SafeDumper,
+                     default_flow_style=False, indent=2, sort_keys=False)
+
 class LabConfig:
     """
     LabConfig: class that encapsulate all the data and action for configuring
@@ -30,7 +76,13 @@ class LabConfig:
     """
     def __init__(self, path: Path):
         self.path = path
-        self.data = DEFAULT_LAB_CONFIG.copy()
+
+    @functools.cached_property
+    def data(self):
+        """
+        data: default configuration, materialized only when nothing was loaded
+        """
+        return fill_defaults({}, DEFAULT_LAB_CONFIG)
 
     def load(self):
         """
@@ -38,7 +90,10 @@ class LabConfig:
         """
         if self.path.exists():
             try:
-                self.data.update(yaml.safe_load(self.path.read_text()))
+                with self.path.open("rb") as f:
+                    loaded = yaml.load(f, Loader=SafeLoader)
+                self.data = fill_defaults(validate_config(loaded, DEFAULT_LAB_CONFIG),
+                                          DEFAULT_LAB_CONFIG)
             except Exception as e:
                 raise RuntimeError(f"Failed to load lab.yaml: {e}") from e
         else:
@@ -49,6 +104,67 @@ class LabConfig:
         """
         save: saves configuration to lab.yaml
         """
-        self.path.write_text(
-            yaml.dump(self.data, default_flow_style=False, indent=2)
-        )
+        if self.data == DEFAULT_LAB_CONFIG:
+            self.path.write_text(default_lab_yaml())
+            return
+        with self.path.open("w") as f:
+            yaml.dump(self.data, f, Dumper=SafeDumper, default_flow_style=False, indent=2,
+                      sort_keys=False)
+
+class LabYamlCache:
+    """
+    LabYamlCache: parsed lab.yaml documents persisted as JSON and keyed by
+    (mtime_ns, size), so commands that scan every lab skip re-parsing YAML
+    for labs that have not changed since the previous run
+    """
+    def __init__(self, path: Path = CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            entries = None  # missing or corrupt cache, rebuilt on save
+        if isinstance(entries, dict):
+            self.entries = entries
+        else:
+            self.dirty = entries is not None
+        self.seen = set()
+
+    def read(self, lab_yaml: Path, st: os.stat_result | None = None):
+        """
+        read: returns the parsed lab.yaml, from cache when it is unchanged
+        """
+        st = st or lab_yaml.stat()
+        key = str(lab_yaml)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        # Malformed entries count as misses and get rewritten below
+        if (
+            isinstance(entry, dict)
+            and entry.get("mtime_ns") == st.st_mtime_ns
+            and entry.get("size") == st.st_size
+            and isinstance(entry.get("data"), dict)
+        ):
+            return entry["data"]
+
+        with lab_yaml.open("rb") as f:
+            data = yaml.load(f, Loader=SafeLoader) or {}
+        self.entries[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "data": data}
+        self.dirty = True
+        return data
+
+    def save(self):
+        """
+        save: writes entries read during this run back to the cache file
+        """
+        if not self.dirty and self.seen == self.entries.keys():
+            return
+        entries = {k: v for k, v in self.entries.items() if k in self.seen}
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(entries, default=str))
+            os.replace(tmp, self.path)
+        except OSError:
+            tmp.unlink(missing_ok=True)  # cache is best-effort
@@ -1,17 +1,19 @@
 """
 global_config.py purpose is to provide global configuration handler for labkit
 """
+import functools
 import os
 from pathlib import Path
 import yaml
+from .config import SafeLoader, SafeDumper, validate_config
 
 # DEFAULT_ROOT = str(Path.home() / "workspace" / "labs")
 DEFAULT_ROOT = "/home/aprksy/workspace/repo/git/project-labs/labs"
 DEFAULT_CONFIG = {
     "default_root": DEFAULT_ROOT,
-    "search_paths": [
+    "search_paths": (
         DEFAULT_ROOT,
-    ],
+    ),
     "default_template": "golden-arch",
     "user": os.getenv("USER", "unknown"),
 }
@@ -19,6 +21,43 @@ DEFAULT_CONFIG = {
 CONFIG_DIR = Path.home() / ".config" / "labkit"
 CONFIG_FILE = CONFIG_DIR / "config.yaml"
 
+def _split_paths(value):
+    """Comma-separated paths"""
+    return [p.strip() for p in value.split(",")]
+
+# (environment variable, config key, converter) overrides
+_ENV_MAPPING = (
+    ("LABKIT_DEFAULT_ROOT", "default_root", str),
+    ("LABKIT_SEARCH_PATHS", "search_paths", _split_paths),
+    ("LABKIT_DEFAULT_TEMPLATE", "default_template", str),
+    ("LABKIT_USER", "user", str),
+)
+
+# Parsed CONFIG_FILE keyed by (mtime_ns, size), reused for the process lifetime
+_parsed_cache = {}
+
+
+def _read_config_file():
+    """
+    _read_config_file: parses CONFIG_FILE, reusing the previous parse while the
+    file is unchanged. Returns None if the file does not exist.
+    """
+    try:
+        st = CONFIG_FILE.stat()
+    except FileNotFoundError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    if key not in _parsed_cache:
+        _parsed_cache.clear()
+        with CONFIG_FILE.open("rb") as f:
+            _parsed_cache[key] = validate_config(yaml.load(f, Loader=SafeLoader), DEFAULT_CONFIG)
+    return dict(_parsed_cache[key])
+
+
+def invalidate_cache():
+    """Drop the cached parse of CONFIG_FILE"""
+    _parsed_cache.clear()
+
 
 class LabkitConfig:
     """
@@ -26,70 +65,72 @@ class LabkitConfig:
     labkit app globally
     """
     def __init__(self):
-        self.data = DEFAULT_CONFIG.copy()
+        # Own list: the shared default stays an immutable tuple
+        self.data = {**DEFAULT_CONFIG, "search_paths": list(DEFAULT_CONFIG["search_paths"])}
+        self.default_root = None
 
     def load(self):
         """Load config from disk, then apply .env overrides"""
-        if CONFIG_FILE.exists():
-            try:
-                loaded = yaml.safe_load(CONFIG_FILE.read_text()) or {}
-                # Merge lists and dicts
-                if "search_paths" in loaded:
-                    self.data["search_paths"] = loaded["search_paths"]
-                self.data.update({
-                    k: v for k, v in loaded.items()
-                    if k != "search_paths"
-                })
-            except Exception as e:
-                raise RuntimeError(f"Failed to load {CONFIG_FILE}: {e}") from e
+        try:
+            loaded = _read_config_file()
+        except Exception as e:
+            raise RuntimeError(f"Failed to load {CONFIG_FILE}: {e}") from e
+        if loaded is not None:
+            # Merge lists and dicts
+            if "search_paths" in loaded:
+                self.data["search_paths"] = loaded["search_paths"]
+            self.data.update({
+                k: v for k, v in loaded.items()
+                if k != "search_paths"
+            })
 
         # Apply .env overrides
         self._apply_env_overrides()
 
-        # Ensure search_paths is list of Path objects
+        # Keep search_paths as raw strings; they are resolved on first use
         if isinstance(self.data["search_paths"], str):
             self.data["search_paths"] = [self.data["search_paths"]]
-        self.data["search_paths"] = [
-            Path(p).expanduser().resolve()
-            for p in self.data["search_paths"]
-        ]
+        self.data["search_paths"] = [str(p) for p in self.data["search_paths"]]
+        self.__dict__.pop("search_paths", None)
+
+        # Normalize once so callers can compare against it directly
+        self.default_root = os.path.realpath(
+            os.path.expanduser(str(self.data["default_root"]))
+        )
 
         return self
 
+    @functools.cached_property
+    def search_paths(self):
+        """Resolved search paths as Path objects, computed on first access"""
+        return [Path(p).expanduser().resolve() for p in self.data["search_paths"]]
+
     def _apply_env_overrides(self):
         """Override config with .env values"""
-        env_mapping = {
-            "LABKIT_DEFAULT_ROOT": "default_root",
-            "LABKIT_SEARCH_PATHS": "search_paths",
-            "LABKIT_DEFAULT_TEMPLATE": "default_template",
-            "LABKIT_USER": "user",
-        }
-        for env_key, config_key in env_mapping.items():
-            if env_key in os.environ:
-                value = os.environ[env_key]
-                if config_key == "search_paths":
-                    # Comma-separated paths
-                    self.data[config_key] = [p.strip() for p in value.split(",")]
-                else:
-                    self.data[config_key] = value
+        for env_key, config_key, convert in _ENV_MAPPING:
+            value = os.environ.get(env_key)
+            if value is not None:
+                self.data[config_key] = convert(value)
 
     def save(self):
         """Save current config back to disk"""
         CONFIG_DIR.mkdir(parents=True, exist_ok=True)
         data = {
             "default_root": self.data["default_root"],
-            "search_paths": [str(p) for p in self.data["search_paths"]],
+            "search_paths": [str(p) for p in self.search_paths],
             "default_template": self.data["default_template"],
             "user": self.data["user"],
         }
-        CONFIG_FILE.write_text(
-            yaml.dump(data, indent=2, default_flow_style=False)
-        )
+        with CONFIG_FILE.open("w") as f:
+            yaml.dump(data, f, Dumper=SafeDumper, indent=2, default_flow_style=False,
+                      sort_keys=False)
+        invalidate_cache()
 
     def add_search_path(self, path: Path):
         """Add a new path to search_paths if not present"""
         resolved = path.expanduser().resolve()
-        if resolved not in self.data["search_paths"]:
-            self.data["search_paths"].append(resolved)
+        if resolved not in self.search_paths:
+            self.search_paths.append(resolved)
+            self.data["search_paths"].append(str(resolved))
             return True
         return False
@@ -1,15 +1,16 @@
 """
 lab.py: module that serve homelab management using Incus containers
 """
-import json
 import getpass
 import os
 from pathlib import Path
+import re
 import subprocess
 from datetime import datetime
 import yaml
-from .config import LabConfig
-from .utils import container_exists, run, info, success, error, warning
+from .config import LabConfig, SafeDumper
+from .utils import container_exists, json_loads, list_containers, list_subdirs, run, info, \
+    success, error, warning
 
 class Lab:
     """
@@ -217,12 +218,10 @@ class Lab:
             info(f"Target nodes: {', '.join(target_nodes)}")
 
         # Get current container states
-        result = run(["incus", "list", "--format=json"], silent=True)
-        containers = json.loads(result.stdout)
-        running_names = {c["name"] for c in containers if c["status"] == "Running"}
+        running_names = {c["name"] for c in list_containers() if c["status"] == "Running"}
 
         # Determine which local nodes to start
-        local_node_dirs = [d.name for d in self.nodes_dir.iterdir() if d.is_dir()]
+        local_node_dirs = list_subdirs(self.nodes_dir)
         local_to_start = []
 
         if only:
@@ -322,12 +321,10 @@ class Lab:
         down: bring down the lab, stop Incus containers
         """
         # Get current container states
-        result = run(["incus", "list", "--format=json"], silent=True)
-        containers = json.loads(result.stdout)
-        running_names = {c["name"] for c in containers if c["status"] == "Running"}
+        running_names = {c["name"] for c in list_containers() if c["status"] == "Running"}
 
         # Determine which local nodes to stop
-        local_node_dirs = [d.name for d in self.nodes_dir.iterdir() if d.is_dir()]
+        local_node_dirs = list_subdirs(self.nodes_dir)
         local_to_stop = []
 
         if only and (force_stop_all or suspend_required):
@@ -581,9 +578,7 @@ class Lab:
         """
         get_node_count: get node count inside the homelab
         """
-        if not self.nodes_dir.exists():
-            return 0
-        return len([d for d in self.nodes_dir.iterdir() if d.is_dir()])
+        return len(list_subdirs(self.nodes_dir))
 
     def save_config(self):
         """
@@ -597,24 +592,23 @@ class Lab:
         }
         if "requires_nodes" in self.config and self.config["requires_nodes"]:
             data["requires_nodes"] = self.config["requires_nodes"]
-        (self.root / "lab.yaml").write_text(
-            yaml.dump(data, indent=2, default_flow_style=False)
-        )
+        with self.config_path.open("w") as f:
+            yaml.dump(data, f, Dumper=SafeDumper, indent=2, default_flow_style=False,
+                      sort_keys=False)
 
     def get_container_state(self, container_name: str) -> str | None:
         """
         get_container_state: return container status: 'Running', 'Stopped', 
         or None if not found
         """
-        result = run(["incus", "list", container_name, "--format=json"], silent=True, check=False)
+        # Anchored regex filter: a bare name matches every instance with that prefix
+        result = run(["incus", "list", f"^{re.escape(container_name)}$", "--format=json"],
+                     silent=True, check=False)
         if result.returncode != 0:
             return None
         try:
-            data = json.loads(result.stdout)
-            for c in data:
-                if c["name"] == container_name:
-                    return c["status"]
-            return None
+            data = json_loads(result.stdout)
+            return next((c["status"] for c in data if c["name"] == container_name), None)
         except Exception as e:
             raise RuntimeError(f"Failed to get container state: {e}") from e
 
@@ -622,8 +616,6 @@ def list_templates():
     """
     list_templates: lists all available templates
     """
-    result = run(["incus", "list", "--format=json"], silent=True)
-    containers = json.loads(result.stdout)
-    templates = [c for c in containers if c["config"].get("user.template") == "true"]
+    templates = [c for c in list_containers() if c["config"].get("user.template") == "true"]
     for c in templates:
         print(f"{c['name']}: {c.get('description', 'No description')}")
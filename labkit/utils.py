@@ -2,17 +2,51 @@
 utils.py: module that serve general functionalities for use with lab but not directly
 operates in side the lab ops.
 """
+import functools
+import os
+import socket
 import subprocess
 import sys
+import time
+import yaml
+from .config import SafeLoader
+try:
+    from orjson import loads as json_loads
+except ImportError:  # optional "fast" extra not installed
+    from json import loads as json_loads
 
-def run(cmd, check=True, silent=False):
-    """
-    run: runs shell command
-    """
+# container_exists results are reused for this many seconds
+EXISTS_TTL = 0.5
+
+# incus subcommands that create, remove or rename instances
+_MUTATING = {"copy", "delete", "init", "launch", "move", "rename", "rm"}
+
+# incus subcommands that change instance state without touching existence
+_STATE_CHANGING = _MUTATING | {"pause", "restart", "start", "stop"}
+
+_exists_cache: dict[str, tuple[float, bool]] = {}
+
+# Local Incus daemon socket, overridable the same way the incus CLI allows
+INCUS_SOCKET = os.getenv("INCUS_SOCKET") or os.path.join(
+    os.getenv("INCUS_DIR") or "/var/lib/incus", "unix.socket"
+)
+
+def run(cmd, check=True, silent=False, capture=True):
+    """
+    run: runs shell command. silent captures the output as text instead of
+    printing it; silent with capture=False discards it unread, for callers
+    that only look at the return code
+    """
+    if len(cmd) > 1 and cmd[0] == "incus" and cmd[1] in _STATE_CHANGING:
+        list_containers.cache_clear()
+        if cmd[1] in _MUTATING:
+            invalidate_container()
+    if silent and not capture:
+        output = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    else:
+        output = {"capture_output": silent, "text": True}
     try:
-        result = subprocess.run(
-            cmd, capture_output=silent, text=True, check=check
-        )
+        result = subprocess.run(cmd, check=check, **output)
         return result
     except subprocess.CalledProcessError as e:
         if not silent:
@@ -25,28 +59,141 @@ def ensure_incus_running():
     """
     ensure_incus_running: ensures incus is running
     """
-    result = run(["incus", "info"], silent=True, check=False)
+    result = run(["incus", "info"], silent=True, check=False, capture=False)
     if result.returncode != 0:
         fatal("Incus daemon is not running. Start with: sudo systemctl start incus")
         sys.exit(1)
 
+def incus_api_get(path: str, timeout=5):
+    """
+    incus_api_get: GETs path from the Incus REST API on the local socket
+    and returns the response metadata. Raises OSError when the socket is
+    unreachable or the request fails
+    """
+    import http.client  # pulls in ssl and email; only needed here
+
+    class UnixHTTPConnection(http.client.HTTPConnection):
+        """HTTP connection to the local Incus daemon socket"""
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(INCUS_SOCKET)
+
+    conn = UnixHTTPConnection("localhost", timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        body = json_loads(response.read())
+    except (http.client.HTTPException, ValueError) as e:
+        raise OSError(f"Incus API {path}: {e}") from e
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise OSError(f"Incus API {path}: {body.get('error') or response.status}")
+    return body["metadata"]
+
+def cli_local_project():
+    """
+    cli_local_project: the project 'incus' commands act on when they go to
+    the local daemon socket, read from the CLI's config.yml. None when the
+    CLI targets another remote, or its settings cannot be read
+    """
+    if os.getenv("INCUS_REMOTE") or os.getenv("INCUS_PROJECT"):
+        return None
+    conf_dir = os.getenv("INCUS_CONF") or os.path.expanduser("~/.config/incus")
+    try:
+        with open(os.path.join(conf_dir, "config.yml"), "rb") as f:
+            conf = yaml.load(f, Loader=SafeLoader) or {}
+    except FileNotFoundError:
+        conf = {}
+    except (OSError, yaml.YAMLError):
+        return None
+    remote_name = conf.get("default-remote") or "local"
+    remote = (conf.get("remotes") or {}).get(remote_name)
+    if remote is None:
+        # Only the built-in "local" remote exists without an entry
+        return "default" if remote_name == "local" else None
+    if remote.get("addr") not in ("unix://", f"unix://{INCUS_SOCKET}"):
+        return None
+    return remote.get("project") or "default"
+
+def fetch_instances() -> list[dict]:
+    """
+    fetch_instances: returns the instances with their state, the same data
+    as 'incus list --format=json'. When the CLI points at the local daemon,
+    asks its REST API directly for the CLI's current project; the CLI is
+    only spawned for other remotes or when the socket is not usable.
+    Never cached
+    """
+    project = cli_local_project()
+    if project is not None:
+        try:
+            return incus_api_get(f"/1.0/instances?recursion=2&project={project}")
+        except OSError:
+            pass
+    result = run(["incus", "list", "--format=json"], silent=True)
+    return json_loads(result.stdout)
+
+@functools.cache
+def list_containers() -> list[dict]:
+    """
+    list_containers: fetch_instances(), fetched once and shared by every
+    caller until run() executes an incus command that changes instance state
+    """
+    return fetch_instances()
+
 def container_exists(name: str) -> bool:
     """
     container_exists: checks if an Incus container or snapshot exists.
-    Uses 'incus info' because it's fast and authoritative.
+    Uses 'incus info' because it's fast and authoritative. Answers are
+    cached for EXISTS_TTL seconds.
     """
+    now = time.monotonic()
+    hit = _exists_cache.get(name)
+    if hit and now - hit[0] < EXISTS_TTL:
+        return hit[1]
+
     result = run(
         ["incus", "info", name],
         silent=True,
-        check=False
+        check=False,
+        capture=False
     )
-    return result.returncode == 0
+    exists = result.returncode == 0
+    _exists_cache[name] = (now, exists)
+    return exists
+
+def invalidate_container(name: str | None = None):
+    """
+    invalidate_container: drops the cached container_exists answer for name,
+    or for every container when name is None. run() calls this for incus
+    commands that create, delete or rename instances.
+    """
+    if name is None:
+        _exists_cache.clear()
+    else:
+        _exists_cache.pop(name, None)
+
+def list_subdirs(path) -> list[str]:
+    """
+    list_subdirs: returns names of directories directly under path, using the
+    entry type from a single scandir pass instead of a stat per entry.
+    Returns an empty list if path does not exist.
+    """
+    try:
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries if entry.is_dir()]
+    except FileNotFoundError:
+        return []
+
+_TTY = sys.stdout.isatty()
 
 def _color(code):
     """
-    _color: returns color code that can be use inside terminal
+    _color: returns color code that can be use inside terminal, or an empty
+    string when stdout is not a terminal so pipes and log files stay clean
     """
-    return f"\033[{code}m"
+    return f"\033[{code}m" if _TTY else ""
 
 RED = _color("31")
 GREEN = _color("32")
@@ -55,44 +202,53 @@ BLUE = _color("34")
 BOLD = _color("1")
 RESET = _color("0")
 
+# Level prefixes, built once
+_INFO = f"{BLUE}[INFO] "
+_OK = f"{GREEN}[OK] "
+_WARNING = f"{YELLOW}[WARNING] "
+_ERROR = f"{RED}[ERROR] "
+_FATAL = f"{RED}[FATAL] "
+_HEADING = f"\n{BOLD}"
+
 def info(msg):
     """
     info: prints message with formatting for INFO
     """
-    print(f"{BLUE}[INFO] {msg}{RESET}")
+    print(f"{_INFO}{msg}{RESET}")
 
 def success(msg):
     """
     success: prints message with formatting for SUCCEEDED event
     """
-    print(f"{GREEN}[OK] {msg}{RESET}")
+    print(f"{_OK}{msg}{RESET}")
 
 def warning(msg):
     """
     warning: prints message with formatting for WARNING
     """
-    print(f"{YELLOW}[WARNING] {msg}{RESET}")
+    print(f"{_WARNING}{msg}{RESET}")
 
-def confirm(msg):
+def confirm(msg) -> bool:
     """
-    warning: prints message with formatting for CONFIRM
+    confirm: asks a yes/no question formatted as WARNING, defaulting to no
     """
-    print(f"{YELLOW}[WARNING] {msg}{RESET}")
+    reply = input(f"{_WARNING}{msg} (y/N): {RESET}").strip().lower()
+    return reply in ("y", "yes")
 
 def error(msg):
     """
     error: prints message with formatting for FAILED/ERROR event
     """
-    print(f"{RED}[ERROR] {msg}{RESET}")
+    print(f"{_ERROR}{msg}{RESET}")
 
 def fatal(msg):
     """
     fatal: prints message with formatting for unrecoverable failure event
     """
-    print(f"{RED}[FATAL] {msg}{RESET}")
+    print(f"{_FATAL}{msg}{RESET}")
 
 def heading(msg):
     """
     heading: prints message with formatting for heading for more results
     """
-    print(f"\n{BOLD}{msg}{RESET}")
+    print(f"{_HEADING}{msg}{RESET}")